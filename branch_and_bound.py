@@ -1,5 +1,8 @@
 
 from gurobipy import GRB
+import heapq
+import itertools
+import numpy as np
 import time
 import traceback
 
@@ -9,7 +12,8 @@ from gurobipy import GRB
 
 def branch_and_bound(model, tolerance=1e-6, time_limit=120):
     """
-    Branch and bound using iterative DFS.
+    Branch and bound using best-first search (lowest LP bound first), diving into the better
+    child of each node it branches on.
     Parameters:
         model: The Gurobi model object (with the continuous relaxation)
         tolerance: The tolerance level for deciding whether a variable is "close" to 0 or 1 (default: 1e-6)
@@ -27,94 +31,299 @@ def branch_and_bound(model, tolerance=1e-6, time_limit=120):
     nodes_explored = 0
     start_time = time.time()
 
-    stack = [(id(model), model)]
-    active_nodes = {}
-    active_int_nodes = {}
+    # Every node is solved on the one model that was passed in. A node is described by the
+    # bounds it changes relative to the root (var index -> (lb, ub)), so moving between nodes
+    # only touches the variables that differ and no model copies are made. Two nodes always
+    # disagree on the variable where their paths split, so no bounds pattern is ever solved
+    # twice and LP results are not memoized.
+    model._vars = model.getVars()
+    model._constrs = model.getConstrs()
+    # Parameters changed below, restored for the caller at the end
+    original_method = model.Params.Method
+    original_time_limit = model.Params.TimeLimit
+    original_cutoff = model.Params.Cutoff
+    model.Params.Method = 1  # Dual simplex re-optimizes quickly after a bound change
+    root_bounds = {}
+    current_bounds = {}
+    root_lp = None  # Objective, values, reduced costs and bounds of the root LP, for variable fixing
 
-    while stack and time.time() - start_time < time_limit:
-        _, current_model = stack.pop()
-        current_id = id(current_model)
-        nodes_explored += 1
+    # Frontier entries are (LP bound, node id, bounds, optimal basis) of nodes that were solved
+    # when their parent was branched on; node ids are unique, so heapq never has to compare the
+    # bounds dicts. The root goes in unsolved, with no bound and no basis.
+    counter = itertools.count()
+    frontier = [(float('-inf'), next(counter), {}, None)]
+    # (LP bound, bounds) of the child being dived into; the model holds its solution, so it is
+    # branched on straight away instead of going through the frontier
+    dive = None
 
-        # Set the remaining time limit for this branch
-        current_model.Params.TimeLimit = max(time_limit - (time.time() - start_time), 0)
+    while time.time() - start_time < time_limit:
+        if dive is not None:
+            obj_val, bounds = dive
+            dive = None
+        else:
+            if not frontier:
+                break
+            node_bound, _, bounds, basis = heapq.heappop(frontier)
+            if node_bound >= best_objective:
+                continue  # The node's LP bound already fails to beat the incumbent
 
-        # Solve the relaxed model
-        current_model.optimize()
-        if current_model.status != GRB.OPTIMAL :
-            # print('infeasible')
-            active_nodes = {node_id: obj for node_id, obj in active_nodes.items()
-                            if any(node_id == stack_id for stack_id, _ in stack)} #   Remove the current node from active nodes
-            continue  # Skip infeasible or time limit reached nodes
+            _move_to_node(model, root_bounds, current_bounds, bounds)
+            current_bounds = bounds
+            # Best-first search often jumps to another subtree; from the node's own optimal
+            # basis dual simplex gets its solution back without iterating
+            if basis is not None:
+                _set_basis(model, basis)
+            model.Params.TimeLimit = max(time_limit - (time.time() - start_time), 0)
+            model.optimize()
+            if model.status == GRB.TIME_LIMIT:
+                # Still open, so its bound has to count towards the best bound
+                heapq.heappush(frontier, (node_bound, next(counter), bounds, basis))
+                break
+            if basis is None:
+                # Nodes with a basis were counted when they were first solved as children
+                nodes_explored += 1
+            if model.status != GRB.OPTIMAL:
+                # Infeasible, or cut off by an incumbent found since the node was queued (which
+                # may also have fixed more variables through their reduced costs)
+                continue
 
-        obj_val = current_model.objVal
+            obj_val = model.objVal
+            if root_lp is None:
+                root_lp = (obj_val, model.getAttr('X', model._vars), model.getAttr('RC', model._vars),
+                           model.getAttr('LB', model._vars), model.getAttr('UB', model._vars))
 
         if obj_val >= best_objective:
-            active_nodes = {node_id: obj for node_id, obj in active_nodes.items()
-                            if any(node_id == stack_id for stack_id, _ in stack)}  # Remove the current node from active nodes
             continue  # Prune this branch
 
-        active_nodes[current_id] = obj_val
         # Check if the solution is integral
-        fractional_var = choose_branching_variable(current_model, tolerance)
+        fractional_var = choose_branching_variable(model, tolerance)
 
         if fractional_var is None:
-            # Found an integer solution
-            if obj_val < best_objective:
-                best_solution = current_model.copy()
-                best_objective = obj_val
-                active_int_nodes[current_id] = obj_val
-        else:
-            # Branch on the fractional variable
-            var_name = fractional_var.varName
+            # Found an integer solution: the root, a node that variable fixing made integral since
+            # it was queued, or a child that timed out before its solution could be checked
+            best_solution = {'x': model.getAttr('X', model._vars), 'obj': obj_val}
+            best_objective = obj_val
+            _reduced_cost_fixing(model, root_lp, best_objective, root_bounds, current_bounds, tolerance)
+            continue
+
+        # Branch on the fractional variable and solve both children on the model right away:
+        # left branch var <= floor(var.x), right branch var >= ceil(var.x)
+        var_index = fractional_var.index
+        value = fractional_var.x
+        bounds_left = dict(bounds)
+        bounds_left[var_index] = (fractional_var.lb, int(value))
+        bounds_right = dict(bounds)
+        bounds_right[var_index] = (int(value) + 1, fractional_var.ub)
+        # The left child starts from the parent's basis already in the model; keep a copy so
+        # the right child can start from it too
+        parent_basis = _get_basis(model)
+
+        children = []
+        for child_bounds in (bounds_left, bounds_right):
+            _move_to_node(model, root_bounds, current_bounds, child_bounds)
+            current_bounds = child_bounds
+            if child_bounds is bounds_right:
+                _set_basis(model, parent_basis)
+            # Set the remaining time limit for this branch
+            model.Params.TimeLimit = max(time_limit - (time.time() - start_time), 0)
+            # Let the LP solver stop as soon as it proves the node cannot beat the incumbent
+            if best_objective < float('inf'):
+                model.Params.Cutoff = best_objective
+            model.optimize()
+
+            if model.status == GRB.TIME_LIMIT:
+                # Unsolved, so it keeps the parent's bound and has no basis of its own; it is
+                # counted as explored if it is ever popped and solved
+                heapq.heappush(frontier, (obj_val, next(counter), child_bounds, None))
+                continue
+            nodes_explored += 1
+            if model.status != GRB.OPTIMAL or model.objVal >= best_objective:
+                # GRB.CUTOFF lands here too: the child's bound is worse than the incumbent
+                continue  # Skip infeasible or cut off children
+
+            if choose_branching_variable(model, tolerance) is None:
+                # Found an integer solution; keep the variable values rather than a copy of the model
+                best_solution = {'x': model.getAttr('X', model._vars), 'obj': model.objVal}
+                best_objective = model.objVal
+                # A better incumbent shrinks the slack, so more root reduced costs exceed it
+                _reduced_cost_fixing(model, root_lp, best_objective, root_bounds, current_bounds, tolerance)
+                continue
 
-            # Right branch: var >= ceil(var.x)
-            model_right = current_model.copy()
-            model_right.getVarByName(var_name).lb = int(fractional_var.x) + 1
-            stack.append((current_id, model_right)) # Parent id and model
-            # Left branch: var <= floor(var.x)
-            model_left = current_model.copy()
-            model_left.getVarByName(var_name).ub = int(fractional_var.x)
-            stack.append((current_id, model_left))
+            children.append((model.objVal, next(counter), child_bounds, _get_basis(model)))
 
-        active_nodes = {node_id: obj for node_id, obj in active_nodes.items()
-                        if any(node_id == stack_id for stack_id, _ in stack)}  # Remove the node if both of its children are explored
+        # Dive into the child with the better bound and leave the other one on the frontier
+        children = [child for child in children if child[0] < best_objective]
+        if not children:
+            continue
+        better = min(children)
+        for child in children:
+            if child is not better:
+                heapq.heappush(frontier, child)
+        if better[2] is not current_bounds:
+            # The right child was solved last, so the left one is re-solved from its own basis
+            _move_to_node(model, root_bounds, current_bounds, better[2])
+            current_bounds = better[2]
+            _set_basis(model, better[3])
+            model.Params.TimeLimit = max(time_limit - (time.time() - start_time), 0)
+            model.optimize()
+            if model.status != GRB.OPTIMAL:
+                heapq.heappush(frontier, better)
+                continue
+        # Read the objective again: variable fixing after an integral right child may have
+        # tightened the left child since it was first solved
+        dive = (model.objVal, better[2])
+
+    # Leave the caller's model with the bounds and parameters it came in with
+    _move_to_node(model, root_bounds, current_bounds, {})
+    if root_lp is not None:
+        # Reduced cost fixing changed bounds outside branching as well
+        model.setAttr('LB', model._vars, root_lp[3])
+        model.setAttr('UB', model._vars, root_lp[4])
+    model.Params.Method = original_method
+    model.Params.TimeLimit = original_time_limit
+    model.Params.Cutoff = original_cutoff
+    model.update()
 
     time_taken = time.time() - start_time
-    # best bound is equal to minimum of active nodes and active int nodes
-    best_bound = min(min(active_int_nodes.values(), default=best_bound),
-                     min(active_nodes.values(), default=best_bound))
+    # best bound is equal to minimum of the incumbent and the nodes left unexplored
+    open_bounds = [node[0] for node in frontier] + ([dive[0]] if dive is not None else [])
+    best_bound = min(best_objective, min(open_bounds, default=best_bound))
 
     # print(best_bound,best_objective)
-    if best_objective == float('inf'):
-        gap = float('inf')
-    else:
-        gap = 0.0 if best_objective == best_bound else (best_objective - best_bound) / abs(best_objective) * 100
+    gap = _mip_gap(best_objective, best_bound)
     return best_bound, best_objective, time_taken, gap, nodes_explored
 
 
+def _mip_gap(best_objective, best_bound):
+    """
+    Relative gap (in percent) between the incumbent objective and the best bound.
+    """
+    if best_objective == float('inf'):
+        return float('inf')
+    return 0.0 if best_objective == best_bound else (best_objective - best_bound) / abs(best_objective) * 100
+
+
+def _reduced_cost_fixing(model, root_lp, best_objective, root_bounds, current_bounds, tolerance):
+    """
+    Fix the 0-1 variables whose root reduced cost rules out every solution better than the incumbent.
+
+    A variable at 0 in the root LP with reduced cost rc cannot be raised to 1 without the LP bound
+    rising to at least root objective + rc. Once rc exceeds the incumbent minus the root objective,
+    the variable can stay at 0 everywhere, and likewise at 1 for variables there with -rc that
+    large. The fixed bounds replace the root bounds, so they apply to every node that does not
+    branch on the variable itself.
+
+    Args:
+        model (gurobipy.Model): The model shared by all nodes, with its variables cached in model._vars.
+        root_lp (tuple): Objective and per-variable X, RC, LB and UB of the root LP.
+        best_objective (float): Objective of the incumbent.
+        root_bounds (dict): Bounds of variables outside branching, updated with the fixings.
+        current_bounds (dict): Bounds of the node the model currently represents.
+        tolerance (float): How close a value must be to 0 or 1 to count as sitting there.
+    """
+    root_obj, values, reduced_costs, lbs, ubs = root_lp
+    slack = best_objective - root_obj
+    fixings = {}
+    for i, (value, rc, lb, ub) in enumerate(zip(values, reduced_costs, lbs, ubs)):
+        if lb != 0 or ub != 1:
+            continue
+        if value <= tolerance and rc > slack:
+            fixings[i] = (0.0, 0.0)
+        elif value >= 1 - tolerance and -rc > slack:
+            fixings[i] = (1.0, 1.0)
+
+    fixings = {i: bounds for i, bounds in fixings.items() if root_bounds.get(i) != bounds}
+    root_bounds.update(fixings)
+    # The current node's own branching bounds stay as they are
+    untouched = [i for i in fixings if i not in current_bounds]
+    if untouched:
+        untouched_vars = [model._vars[i] for i in untouched]
+        model.setAttr('LB', untouched_vars, [fixings[i][0] for i in untouched])
+        model.setAttr('UB', untouched_vars, [fixings[i][1] for i in untouched])
+
+
+def _get_basis(model):
+    """
+    Read the current simplex basis of the model.
+
+    Basis statuses are small integers (0, -1, -2 or -3), so they are kept as int8 arrays: an open
+    node of a large model holds its basis at one byte per variable and constraint instead of eight.
+
+    Args:
+        model (gurobipy.Model): The model shared by all nodes, with its variables and constraints
+            cached in model._vars and model._constrs.
+
+    Returns:
+        tuple: VBasis and CBasis as numpy int8 arrays.
+    """
+    return (np.array(model.getAttr('VBasis', model._vars), dtype=np.int8),
+            np.array(model.getAttr('CBasis', model._constrs), dtype=np.int8))
+
+
+def _set_basis(model, basis):
+    """
+    Start the next solve of the model from a basis read by _get_basis.
+
+    Args:
+        model (gurobipy.Model): The model shared by all nodes, with its variables and constraints
+            cached in model._vars and model._constrs.
+        basis (tuple): VBasis and CBasis as numpy int8 arrays.
+    """
+    model.setAttr('VBasis', model._vars, basis[0].tolist())
+    model.setAttr('CBasis', model._constrs, basis[1].tolist())
+
+
+def _move_to_node(model, root_bounds, current_bounds, target_bounds):
+    """
+    Change the variable bounds on the model from those of one node to those of another.
+
+    Args:
+        model (gurobipy.Model): The model shared by all nodes, with its variables cached in model._vars.
+        root_bounds (dict): (lb, ub) outside branching of every variable branching has touched; filled in here.
+        current_bounds (dict): Bounds of the node the model currently represents.
+        target_bounds (dict): Bounds of the node to move to.
+    """
+    # Variables the target no longer restricts go back to their root bounds
+    reset = list(current_bounds.keys() - target_bounds.keys())
+    changed = [var_index for var_index, bounds in target_bounds.items() if current_bounds.get(var_index) != bounds]
+
+    # Remember the root bounds of variables branching touches for the first time
+    first_touched = [var_index for var_index in changed if var_index not in root_bounds]
+    if first_touched:
+        first_vars = [model._vars[var_index] for var_index in first_touched]
+        root_bounds.update(zip(first_touched, zip(model.getAttr('LB', first_vars), model.getAttr('UB', first_vars))))
+
+    # Apply every change with one call per bound type
+    new_bounds = [root_bounds[var_index] for var_index in reset] + [target_bounds[var_index] for var_index in changed]
+    if new_bounds:
+        touched_vars = [model._vars[var_index] for var_index in reset + changed]
+        model.setAttr('LB', touched_vars, [lb for lb, _ in new_bounds])
+        model.setAttr('UB', touched_vars, [ub for _, ub in new_bounds])
+
+
 def choose_branching_variable(model, tolerance=1e-6):
     """
     Choose the variable with the value closest to 0.5 for branching in the Gurobi model.
 
     Args:
-        model (gurobipy.Model): The Gurobi model from which to choose the branching variable.
+        model (gurobipy.Model): The Gurobi model from which to choose the branching variable,
+            with its variables cached in model._vars.
         tolerance (float): A small tolerance to avoid selecting variables that are already integer.
 
     Returns:
-        gurobipy.Var or None: First fractional variable, or None if no fractional variable is found.
+        gurobipy.Var or None: Most fractional variable, or None if no fractional variable is found.
     """
-    fractional_vars = []
+    # Read all solution values in one call rather than one var.x lookup per variable
+    values = np.asarray(model.getAttr('X', model._vars))
 
-    # Collect variables that are fractional (not close to integer values)
-    for var in model.getVars():
-        if tolerance < var.x < 1 - tolerance:
-            fractional_vars.append((var, abs(var.x - 0.5)))
-            return fractional_vars[0][0]
+    # Fractional variables (not close to integer values)
+    fractional = np.flatnonzero((values > tolerance) & (values < 1 - tolerance))
 
     # If no fractional variables are found, return None
-    if not fractional_vars:
+    if fractional.size == 0:
         return None
+    best_index = fractional[np.argmin(np.abs(values[fractional] - 0.5))]
+    return model._vars[best_index]
 
 
 
@@ -2,18 +2,15 @@ import os
 import numpy as np
 import gurobipy as gp
 from gurobipy import GRB
-from  branch_and_bound import branch_and_bound
-import pandas as pd
+from concurrent.futures import as_completed
+from result_log import append_row, completed_files, sort_rows
+from worker_pool import run_branch_and_bound, solver_pool, worker_env
 import time
 import traceback
 
-# Helper function to extract 100 elements from multiple lines (12 per line)
-def extract_full_row(start_idx, lines_needed, lines):
-    elements = []
-    for i in range(lines_needed):
-        line_elements = list(map(int, lines[start_idx + i].split()))
-        elements.extend(line_elements)
-    return elements
+
+output_dir = 'lp_files_gap'
+res_dir = 'results'
 
 
 def read_gap_file(file_path):
@@ -22,55 +19,35 @@ def read_gap_file(file_path):
         # Read the first line which contains m and n
         m, n = map(int, lines[0].split())
 
-        lines_reqd = n // 12 + 1
-        # Initialize lists to hold the resources and costs
-        costs = []
-        resources = []
-        capacity_constraints = []
-
-        # Extract costs (first m rows of 100 elements each)
-        cost_start_idx = 1
-        for i in range(m):
-            costs.append(extract_full_row(cost_start_idx + i * lines_reqd, lines_reqd, lines))
-
-        # Extract resources (next m rows of 100 elements each)
-        resource_start_idx = cost_start_idx + m * (lines_reqd)
-        for i in range(m):
-            resources.append(extract_full_row(resource_start_idx + i * lines_reqd, lines_reqd, lines))
-
-        # Extract the final capacity constraint values
-        capacity_start_idx = resource_start_idx + m * (lines_reqd)
-        capacity_constraints = list(map(int, ' '.join(lines[capacity_start_idx:]).split()))
-
-        # Convert lists to numpy arrays (optional)
-        costs = np.array(costs)
-        resources = np.array(resources)
-        capacity_constraints = np.array(capacity_constraints)
+        # The rest of the file is m rows of costs, m rows of resources and m capacities,
+        # so parse every number in one pass and slice the blocks out of it
+        data = np.fromstring(' '.join(lines[1:]), sep=' ', dtype=np.int64)
 
+        costs = data[:m * n].reshape(m, n)
+        resources = data[m * n:2 * m * n].reshape(m, n)
+        capacity_constraints = data[2 * m * n:2 * m * n + m]
 
         return m, n, costs, resources, capacity_constraints
 
 
-def solve_gap(resource_matrix, cost_matrix, capacity, m, n, results, file, output_file="model.lp" ):
+def solve_gap(resource_matrix, cost_matrix, capacity, m, n, results, file, output_file=None):
+    # Returns the solved MIP model and its LP relaxation; the relaxation is also written to
+    # output_file when one is given
     # Create a new model
-    model = gp.Model("GAP")
+    model = gp.Model("GAP", env=worker_env())
+    model.setParam("TimeLimit", 120)
 
-    # Suppress the output (initial Gurobi information)
-    model.setParam('OutputFlag', 0)
-    gp.setParam("TimeLimit", 120)
+    # Create binary assignment variables; the relaxation comes from model.relax() after the solve
+    x = model.addMVar((m, n), vtype=GRB.BINARY, name="x")
 
-    # Create variables (continuous instead of binary)
-    x = model.addVars(m, n, vtype=GRB.BINARY, name="x")
+    # Set objective (minimize cost); the matrix API builds the expression inside Gurobi
+    model.setObjective((x * cost_matrix).sum(), GRB.MINIMIZE)
 
-    # Set objective (minimize cost)
-    model.setObjective(sum(cost_matrix[i][j] * x[i, j] for i in range(m) for j in range(n)), GRB.MINIMIZE)
-
-    # Each task is assigned to exactly one resource (relaxed to continuous)
-    model.addConstrs((x.sum('*', j) == 1 for j in range(n)), name="task")
+    # Each task is assigned to exactly one resource
+    model.addConstr(x.sum(axis=0) == 1, name="task")
 
     # Capacity constraints (keeping them as constraints)
-    model.addConstrs((sum(resource_matrix[i][j] * x[i, j] for j in range(n)) <= capacity[i] for i in range(m)),
-                     name="capacity")
+    model.addConstr((x * resource_matrix).sum(axis=1) <= capacity, name="capacity")
 
     # Optimize model
     model.optimize()
@@ -87,12 +64,11 @@ def solve_gap(resource_matrix, cost_matrix, capacity, m, n, results, file, outpu
         gap = model.MIPGap * 100  # MIPGap is a percentage
         nodes_explored = model.NodeCount
 
-    # After solving, convert variables from binary to continuous and ensure bounds
-    for var in model.getVars():
-        var.vtype = GRB.CONTINUOUS  # Convert to continuous
-    # Write the modified model with continuous variables to an .lp file
-    model.update()  # Ensure the model reflects changes to the variable types
-    model.write(output_file)
+    # After solving, build the relaxation with every variable continuous
+    relaxed = model.relax()
+    # Write the relaxation to an .lp file
+    if output_file is not None:
+        relaxed.write(output_file)
 
     results.append({
         "File": file,
@@ -103,54 +79,39 @@ def solve_gap(resource_matrix, cost_matrix, capacity, m, n, results, file, outpu
         "Time Taken (seconds)": total_time
     })
 
-    # return model
+    return model, relaxed
 
 
 
 
-output_dir = 'lp_files_gap'
-os.makedirs(output_dir, exist_ok=True)
+def run_instance(file_path):
+    # Gurobi row and custom branch and bound row of one instance
+    file = os.path.basename(file_path)
+    m, n, cost_matrix, resource_matrix, capacity = read_gap_file(file_path)
+    results = []
+    model, relaxed = solve_gap(resource_matrix, cost_matrix, capacity, m, n, results, file, os.path.join(output_dir, f"{file}.lp"))
+    return results[0], run_branch_and_bound(file, model, relaxed, time_limit=120, tolerance=1e-10)
 
-res_dir = 'results'
-os.makedirs(res_dir, exist_ok=True)
-
-#
-results = []
-for root, dirs, files in os.walk("GAP"):
-    for file in sorted(files):
-        # if file.startswith("a05"):
-        #     print(f"File: {file}")
-            m, n, cost_matrix, resource_matrix, capacity = read_gap_file(os.path.join(root, file))
-            # print(f"m = {m}, n = {n}")
-            solve_gap(resource_matrix, cost_matrix, capacity, m, n,results,file, os.path.join(output_dir, f"{file}.lp"))
-            # model = solve_gap(resource_matrix, cost_matrix, capacity, m, n, os.path.join(output_dir, f"{file}.lp"))
-            print()
-df = pd.DataFrame(results)
-df.to_csv(os.path.join(res_dir, 'gurobi_gap.csv'), index=False)
-
-# Branch and bound
-
-results = []
-for root, dirs, files in os.walk("GAP"):
-    sorted_files = sorted(files)
-    for file in sorted_files:
-        # if file.startswith("a05"):
-            model = gp.read(os.path.join(output_dir, f"{file}.lp"))
-            model.setParam('OutputFlag', 0)
-
-
-            best_lp_relaxation, best_objective, time_taken, gap, nodes_explored = branch_and_bound(model,time_limit=120, tolerance=1e-10)
-            results.append({
-                "File": file,
-                "LP Relaxation": best_lp_relaxation if best_lp_relaxation != float('inf') else 'inf',
-                "Best Objective": best_objective if best_objective is not None else 'None',
-                "Nodes Explored": nodes_explored,
-                "Gap (%)": gap if gap != float('inf') else 'inf',
-                "Time Taken (seconds)": time_taken if time_taken is not None else 0
-            })
-
-            # Convert the results list into a pandas DataFrame
-df = pd.DataFrame(results)
-# Save the DataFrame to a CSV file
-df.to_csv(os.path.join(res_dir, 'custom_gap.csv'), index=False)
 
+if __name__ == "__main__":
+    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(res_dir, exist_ok=True)
+
+    gurobi_csv = os.path.join(res_dir, 'gurobi_gap.csv')
+    custom_csv = os.path.join(res_dir, 'custom_gap.csv')
+    gurobi_done = completed_files(gurobi_csv)
+    custom_done = completed_files(custom_csv)
+
+    paths = [os.path.join(root, file) for root, dirs, files in os.walk("GAP") for file in sorted(files)
+             if not (file in gurobi_done and file in custom_done)]
+
+    with solver_pool() as ex:
+        for future in as_completed([ex.submit(run_instance, path) for path in paths]):
+            gurobi_row, custom_row = future.result()
+            if gurobi_row["File"] not in gurobi_done:
+                append_row(gurobi_csv, gurobi_row)
+            if custom_row["File"] not in custom_done:
+                append_row(custom_csv, custom_row)
+
+    sort_rows(gurobi_csv)
+    sort_rows(custom_csv)
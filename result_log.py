@@ -0,0 +1,36 @@
+import csv
+import os
+
+
+def completed_files(csv_path):
+    # Files that already have a row in csv_path, so an interrupted sweep can skip them
+    if not os.path.exists(csv_path):
+        return set()
+    with open(csv_path, newline='') as f:
+        return {row['File'] for row in csv.DictReader(f)}
+
+
+def append_row(csv_path, row):
+    # Append one result row as soon as it is available, writing the header for a new file
+    write_header = not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0
+    with open(csv_path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(row))
+        if write_header:
+            writer.writeheader()
+        writer.writerow(row)
+        f.flush()
+
+
+def sort_rows(csv_path):
+    # Rows are appended in the order instances finish, which changes from run to run; sort them
+    # by file once the sweep is done so the tables and their diffs stay stable
+    if not os.path.exists(csv_path):
+        return
+    with open(csv_path, newline='') as f:
+        reader = csv.DictReader(f)
+        fieldnames = reader.fieldnames
+        rows = sorted(reader, key=lambda row: row['File'])
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
@@ -2,64 +2,44 @@ import os
 import numpy as np
 import gurobipy as gp
 from gurobipy import GRB
-import pandas as pd
 import time
-from branch_and_bound import branch_and_bound
+from concurrent.futures import as_completed
+from result_log import append_row, completed_files, sort_rows
+from worker_pool import run_branch_and_bound, solver_pool, worker_env
 
-def solve_tsp(n, c, results, file,output_file=None, time_limit=120):
+
+res_dir = 'results'
+output_dir_mtz = 'lp_files_mtz'
+output_dir_mcf = 'lp_files_cw_mcf'
+output_dir_scf = 'lp_files_gg_scf'
+# The multi-commodity flow model has n^3 flow variables: Gurobi only gets it up to this many
+# nodes (not the rbg instances), the custom branch and bound only up to the smaller limit (not ftv170)
+MCF_MAX_NODES = 200
+MCF_BRANCH_AND_BOUND_MAX_NODES = 100
+
+
+def solve_and_relax(m, results, file, output_file=None):
     """
-    Solve the traveling salesman problem with Gurobi
+    Solve a TSP model built by one of the solvers below and record its result row
 
     Parameters:
-    n (int): Number of nodes
-    c (list of lists): Cost matrix
-    output_file (str): Name of the output file
-    time_limit (int): Time limit in seconds
+    m (gurobipy.Model): The MIP model, with every constraint added
+    results (list): Receives the Gurobi result row of the instance
+    file (str): Name of the instance file
+    output_file (str): Name of the .lp file the relaxation is written to, if any
 
     Returns:
-    None
+    The solved MIP model and its LP relaxation
     """
-    # add time limit
-    if time_limit is not None:
-        gp.setParam("TimeLimit", time_limit)
-    
-
-    m = gp.Model("tsp")
-    # Suppress the output (initial Gurobi information)
-    m.setParam('OutputFlag', 0)
-    x = m.addVars(n, n, vtype=GRB.BINARY, name="x")
-    u = m.addVars(n, vtype=GRB.CONTINUOUS, name="u")
-    m.setObjective(gp.quicksum(c[i][j] * x[i, j] for i in range(n) for j in range(n)), GRB.MINIMIZE)
-
-    # Add constraints
-    m.addConstrs((gp.quicksum(x[i, j] for j in range(n)) == 1 for i in range(n)), name="out")
-    m.addConstrs((gp.quicksum(x[j, i] for j in range(n)) == 1 for i in range(n)), name="in")
-    # m.addConstrs((u[i] - u[j] + n * x[i, j] <= n - 1 for i in range(1, n) for j in range(1, n)), name="subtour")
-    # Subtour elimination constraints (MTZ formulation)
-    # Ensure that u[1] = 1 and u[i] is between 2 and n for nodes 2 to n
-    m.addConstr(u[0] == 1, name="u_1_fixed")
-    m.addConstrs((u[i] >= 2 for i in range(1, n)), name="u_lower_bound")
-    m.addConstrs((u[i] <= n for i in range(1, n)), name="u_upper_bound")
-
-    # Subtour elimination: u[i] - u[j] + n * x[i, j] <= n - 1 for i != j
-    m.addConstrs((u[i] - u[j] + n * x[i, j] <= n - 1 for i in range(1, n) for j in range(1, n) if i != j), name="subtour")
-
     m.optimize()
     total_time = m.Runtime
 
-    best_objective = None
-    best_bound = None
-    gap = None
-    nodes_explored = None
-
     best_objective = m.objVal if hasattr(m, 'objVal') else None
     best_bound = m.ObjBound if hasattr(m, 'ObjBound') else None
     gap = m.MIPGap * 100 if hasattr(m, 'MIPGap') else None
     nodes_explored = m.NodeCount if hasattr(m, 'NodeCount') else None
-    for var in m.getVars():
-        var.vtype = GRB.CONTINUOUS  # Convert to continuous
-    # Write the modified model with continuous variables to an .lp file
-    m.update()  # Ensure the model reflects changes to the variable types
+    # Build the relaxation with every variable continuous
+    relaxed = m.relax()
     results.append({
         "File": file,
         "Best Bound": best_bound if best_bound else 'None',
@@ -68,9 +48,49 @@ def solve_tsp(n, c, results, file,output_file=None, time_limit=120):
         "Nodes Explored": nodes_explored if nodes_explored else 'None',
         "Time Taken (seconds)": total_time
     })
-    m.write(output_file)
-    # Return None if no optimal solution is found
-    return None
+    # Write the relaxation to an .lp file
+    if output_file is not None:
+        relaxed.write(output_file)
+    return m, relaxed
+
+
+def solve_tsp(n, c, results, file,output_file=None, time_limit=120):
+    """
+    Solve the traveling salesman problem with Gurobi
+
+    Parameters:
+    n (int): Number of nodes
+    c (list of lists): Cost matrix
+    output_file (str): Name of the output file
+    time_limit (int): Time limit in seconds
+
+    Returns:
+    The solved MIP model and its LP relaxation
+    """
+    m = gp.Model("tsp", env=worker_env())
+    # add time limit
+    if time_limit is not None:
+        m.setParam("TimeLimit", time_limit)
+    # Matrix variables, so every constraint block below is assembled by Gurobi in one call
+    x = m.addMVar((n, n), vtype=GRB.BINARY, name="x")
+    u = m.addMVar(n, vtype=GRB.CONTINUOUS, name="u")
+    m.setObjective((x * c).sum(), GRB.MINIMIZE)
+
+    # Add constraints
+    m.addConstr(x.sum(axis=1) == 1, name="out")
+    m.addConstr(x.sum(axis=0) == 1, name="in")
+    # Subtour elimination constraints (MTZ formulation)
+    # Ensure that u[1] = 1 and u[i] is between 2 and n for nodes 2 to n
+    m.addConstr(u[0] == 1, name="u_1_fixed")
+    m.addConstr(u[1:] >= 2, name="u_lower_bound")
+    m.addConstr(u[1:] <= n, name="u_upper_bound")
+
+    # Subtour elimination: u[i] - u[j] + n * x[i, j] <= n - 1 for i != j, over nodes 2 to n
+    i, j = np.nonzero(~np.eye(n - 1, dtype=bool))
+    i, j = i + 1, j + 1
+    m.addConstr(u[i] - u[j] + n * x[i, j] <= n - 1, name="subtour")
+
+    return solve_and_relax(m, results, file, output_file)
 
 
 
@@ -83,13 +103,11 @@ def solve_tsp_cw_mcf(n, c,results, file,output_file=None, time_limit=120):
     - c: Cost matrix (n x n) representing the cost of traveling from node i to node j
 
     Returns:
-    - None
+    - The solved MIP model and its LP relaxation
     """
-    gp.setParam("TimeLimit", time_limit)
     # Create the Gurobi model
-    m = gp.Model("tsp_cw_mcf")
-    # Suppress the output (initial Gurobi information)
-    m.setParam('OutputFlag', 0)
+    m = gp.Model("tsp_cw_mcf", env=worker_env())
+    m.setParam("TimeLimit", time_limit)
     # Binary variables x[i, j] to indicate if edge (i, j) is in the tour
     x = m.addVars(n, n, vtype=GRB.BINARY, name="x")
 
@@ -97,7 +115,8 @@ def solve_tsp_cw_mcf(n, c,results, file,output_file=None, time_limit=120):
     f = m.addVars(n, n, n, vtype=GRB.CONTINUOUS, name="f")
 
     # Set objective: minimize the total cost of the tour
-    m.setObjective(gp.quicksum(c[i, j] * x[i, j] for i in range(n) for j in range(n)), GRB.MINIMIZE)
+    # x.values() is in row-major (i, j) order, matching c.ravel()
+    m.setObjective(gp.LinExpr(c.ravel().tolist(), x.values()), GRB.MINIMIZE)
 
     # Constraint 1: sum(x[i, j]) over j = sum(x[j, i]) over i = 1 for all i
     m.addConstrs((gp.quicksum(x[i, j] for j in range(n) if i != j) == 1 for i in range(n)), name="out_degree")
@@ -123,30 +142,52 @@ def solve_tsp_cw_mcf(n, c,results, file,output_file=None, time_limit=120):
     # Constraint 7: f[i, j, k] <= x[i, j] for all i, j, k in 1 to n
     m.addConstrs((f[i, j, k] <= x[i, j] for i in range(n) for j in range(n) for k in range(n) if i != j), name="flow_link")
 
-    best_objective = None
-    best_bound = None
-    gap = None
-    nodes_explored = None
-    m.optimize()
-    total_time = m.Runtime
-    best_objective = m.objVal if hasattr(m, 'objVal') else None
-    best_bound = m.ObjBound if hasattr(m, 'ObjBound') else None
-    gap = m.MIPGap * 100 if hasattr(m, 'MIPGap') else None
-    nodes_explored = m.NodeCount if hasattr(m, 'NodeCount') else None
-    for var in m.getVars():
-        var.vtype = GRB.CONTINUOUS  # Convert to continuous
-    # Write the modified model with continuous variables to an .lp file
-    m.update()  # Ensure the model reflects changes to the variable types
-    results.append({
-        "File": file,
-        "Best Bound": best_bound if best_bound else 'None',
-        "Best Objective": best_objective if best_objective else 'None',
-        "GAP (%)": gap if gap else 'None',
-        "Nodes Explored": nodes_explored if nodes_explored else 'None',
-        "Time Taken (seconds)": total_time
-    })
-    m.write(output_file)
-    return None
+    return solve_and_relax(m, results, file, output_file)
+
+
+def solve_tsp_gg_scf(n, c,results, file,output_file=None, time_limit=120):
+    """
+    Solve the Traveling Salesman Problem using the Gavish and Graves single-commodity flow formulation.
+
+    Node 0 ships one unit of flow to every other node, and flow may only travel on arcs of the tour.
+    This needs O(n^2) flow variables and linking constraints instead of the O(n^3) of the
+    multi-commodity flow formulation, at the price of a much weaker LP relaxation.
+
+    Parameters:
+    - n: Number of nodes
+    - c: Cost matrix (n x n) representing the cost of traveling from node i to node j
+
+    Returns:
+    - The solved MIP model and its LP relaxation
+    """
+    # Create the Gurobi model
+    m = gp.Model("tsp_gg_scf", env=worker_env())
+    m.setParam("TimeLimit", time_limit)
+    # Binary variables x[i, j] to indicate if edge (i, j) is in the tour
+    x = m.addVars(n, n, vtype=GRB.BINARY, name="x")
+
+    # Continuous flow variables g[i, j] for the flow from node i to node j
+    arcs = [(i, j) for i in range(n) for j in range(n) if i != j]
+    g = m.addVars(arcs, lb=0, ub=n - 1, vtype=GRB.CONTINUOUS, name="g")
+
+    # Set objective: minimize the total cost of the tour
+    # x.values() is in row-major (i, j) order, matching c.ravel()
+    m.setObjective(gp.LinExpr(c.ravel().tolist(), x.values()), GRB.MINIMIZE)
+
+    # Constraint 1: sum(x[i, j]) over j = sum(x[j, i]) over i = 1 for all i
+    m.addConstrs((gp.quicksum(x[i, j] for j in range(n) if i != j) == 1 for i in range(n)), name="out_degree")
+    m.addConstrs((gp.quicksum(x[j, i] for j in range(n) if i != j) == 1 for i in range(n)), name="in_degree")
+
+    # Constraint 2: sum(g[1, j]) over j = n - 1, node 1 supplies every other node
+    m.addConstr(g.sum(0, '*') == n - 1, name="flow_source")
+
+    # Constraint 3: sum(g[j, i]) over j - sum(g[i, j]) over j = 1 for all i in 2 to n, each node keeps one unit
+    m.addConstrs((g.sum('*', i) - g.sum(i, '*') == 1 for i in range(1, n)), name="flow_conservation")
+
+    # Constraint 4: g[i, j] <= (n - 1) * x[i, j] for all i != j
+    m.addConstrs((g[i, j] <= (n - 1) * x[i, j] for i, j in arcs), name="flow_link")
+
+    return solve_and_relax(m, results, file, output_file)
 
 def read_atsp_file(file_path):
     with open(file_path, 'r') as f:
@@ -163,102 +204,78 @@ def read_atsp_file(file_path):
     return n, c
 
 
-res_dir = 'results'
-os.makedirs(res_dir, exist_ok=True)
-
-output_dir_mtz = 'lp_files_mtz'
-os.makedirs(output_dir_mtz, exist_ok=True)
-
-output_dir_mcf = 'lp_files_cw_mcf'
-os.makedirs(output_dir_mcf, exist_ok=True)
-
-
-results = []
-for root, dirs, files in os.walk("ATSP"):
-        for file in files:
-
-                # print(f"----------------{file}----------------")
-                # print(file)
-                n, c = read_atsp_file(os.path.join(root, file))
-                # time limit is set to 120 seconds
-                # print("MTZ Formulation")
-                solve_tsp(n, c, results,file, output_file=os.path.join(output_dir_mtz, file + '.lp'), time_limit=120)
-                # print()
-df = pd.DataFrame(results)
-df.to_csv(os.path.join(res_dir, 'gurobi_atsp_mtz.csv'), index=False)
-
-results = []
-for root, dirs, files in os.walk("ATSP"):
-        for file in files:
-
-                # print(f"----------------{file}----------------")
-                # print(file)
-                n, c = read_atsp_file(os.path.join(root, file))
-                if not (file.startswith('rbg')):
-                    # print("cw_mcf Formulation")
-                    solve_tsp_cw_mcf(n, c,results, file, output_file=os.path.join(output_dir_mcf, file + '.lp'), time_limit=120)
-                    print()
-
-df = pd.DataFrame(results)
-df.to_csv(os.path.join(res_dir, 'gurobi_atsp_mcf.csv'), index=False)
-
-
-
-output_dir_mcf = 'lp_files_cw_mcf'
-os.makedirs(output_dir_mcf, exist_ok=True)
-results = []
-for root, dirs, files in os.walk("ATSP"):
-    sorted_files = sorted(files)
-    for file in sorted_files:
-        if not (file.startswith('rbg') or file.startswith('ftv170')):
-    # for file in files:
-        # Process each file
-        # print(f"Processing file: {file}")
-            model = gp.read(os.path.join(output_dir_mcf, f"{file}.lp"))
-            model.setParam('OutputFlag', 0)
-
-            best_lp_relaxation, best_objective, time_taken, gap, nodes_explored = branch_and_bound(model, time_limit=120)
-            results.append({
-                "File": file,
-                "LP Relaxation": best_lp_relaxation if best_lp_relaxation != float('inf') else 'inf',
-                "Best Objective": best_objective if best_objective is not None else 'None',
-                "Nodes Explored": nodes_explored,
-                "Gap (%)": gap if gap != float('inf') else 'inf',
-                "Time Taken (seconds)": time_taken if time_taken is not None else 0
-            })
-
-    # Convert the results list into a pandas DataFrame
-df = pd.DataFrame(results)
-# Save the DataFrame to a CSV file
-df.to_csv(os.path.join(res_dir, 'custom_atsp_mcf.csv'), index=False)
-
-
-
-output_dir_mtz = 'lp_files_mtz'
-os.makedirs(output_dir_mtz, exist_ok=True)
-
-results = []
-for root, dirs, files in os.walk("ATSP"):
-    sorted_files = sorted(files)
-    for file in sorted_files:
-        model = gp.read(os.path.join(output_dir_mtz, f"{file}.lp"))
-        model.setParam('OutputFlag', 0)
-
-        best_lp_relaxation, best_objective, time_taken, gap, nodes_explored = branch_and_bound(model)
-
-        # Print LaTeX row for each file
-        results.append({
-            "File": file,
-            "LP Relaxation": best_lp_relaxation if best_lp_relaxation != float('inf') else 'inf',
-            "Best Objective": best_objective if best_objective is not None else 'None',
-            "Nodes Explored": nodes_explored,
-            "Gap (%)": gap if gap != float('inf') else 'inf',
-            "Time Taken (seconds)": time_taken if time_taken is not None else 0
-        })
-
-        # Convert the results list into a pandas DataFrame
-df = pd.DataFrame(results)
-# Save the DataFrame to a CSV file
-df.to_csv(os.path.join(res_dir, 'custom_atsp_mtz.csv'), index=False)
-
-
+def run_mtz(file_path):
+    file = os.path.basename(file_path)
+    n, c = read_atsp_file(file_path)
+    results = []
+    # time limit is set to 120 seconds
+    model, relaxed = solve_tsp(n, c, results,file, output_file=os.path.join(output_dir_mtz, file + '.lp'), time_limit=120)
+    return results[0], run_branch_and_bound(file, model, relaxed, time_limit=120)
+
+
+def mcf_rows(n):
+    # Whether run_mcf produces a (gurobi, custom) row for an instance with n nodes
+    return n <= MCF_MAX_NODES, n <= MCF_BRANCH_AND_BOUND_MAX_NODES
+
+
+def run_mcf(file_path):
+    # Either row is None when the instance is too large for that solver, see mcf_rows
+    file = os.path.basename(file_path)
+    n, c = read_atsp_file(file_path)
+    gurobi_row, custom_row = mcf_rows(n)
+    if not gurobi_row:
+        return None, None
+    results = []
+    model, relaxed = solve_tsp_cw_mcf(n, c,results, file, output_file=os.path.join(output_dir_mcf, file + '.lp'), time_limit=120)
+    if not custom_row:
+        model.dispose()
+        relaxed.dispose()
+        return results[0], None
+    return results[0], run_branch_and_bound(file, model, relaxed, time_limit=120)
+
+
+def run_scf(file_path):
+    file = os.path.basename(file_path)
+    n, c = read_atsp_file(file_path)
+    results = []
+    model, relaxed = solve_tsp_gg_scf(n, c,results, file, output_file=os.path.join(output_dir_scf, file + '.lp'), time_limit=120)
+    return results[0], run_branch_and_bound(file, model, relaxed, time_limit=120)
+
+
+if __name__ == "__main__":
+    os.makedirs(res_dir, exist_ok=True)
+    os.makedirs(output_dir_mtz, exist_ok=True)
+    os.makedirs(output_dir_mcf, exist_ok=True)
+    os.makedirs(output_dir_scf, exist_ok=True)
+
+    # (gurobi csv, custom csv) for each formulation
+    csvs = {
+        run_mtz: (os.path.join(res_dir, 'gurobi_atsp_mtz.csv'), os.path.join(res_dir, 'custom_atsp_mtz.csv')),
+        run_mcf: (os.path.join(res_dir, 'gurobi_atsp_mcf.csv'), os.path.join(res_dir, 'custom_atsp_mcf.csv')),
+        run_scf: (os.path.join(res_dir, 'gurobi_atsp_scf.csv'), os.path.join(res_dir, 'custom_atsp_scf.csv')),
+    }
+    done = {run: (completed_files(gurobi_csv), completed_files(custom_csv)) for run, (gurobi_csv, custom_csv) in csvs.items()}
+
+    paths = [os.path.join(root, file) for root, dirs, files in os.walk("ATSP") for file in sorted(files)]
+    # The rbg instances are too large for the flow formulation
+    scf_paths = [path for path in paths if not os.path.basename(path).startswith('rbg')]
+
+    with solver_pool() as ex:
+        futures = {}
+        for run, run_paths in ((run_mtz, paths), (run_mcf, paths), (run_scf, scf_paths)):
+            for path in run_paths:
+                file = os.path.basename(path)
+                # Only wait for the rows the instance can produce; MCF skips one or both by size
+                rows = mcf_rows(read_atsp_file(path)[0]) if run is run_mcf else (True, True)
+                if any(row and file not in completed for row, completed in zip(rows, done[run])):
+                    futures[ex.submit(run, path)] = run
+
+        for future in as_completed(futures):
+            run = futures[future]
+            for row, csv_path, completed in zip(future.result(), csvs[run], done[run]):
+                if row is not None and row["File"] not in completed:
+                    append_row(csv_path, row)
+
+    for csv_paths in csvs.values():
+        for csv_path in csv_paths:
+            sort_rows(csv_path)
@@ -1,19 +1,20 @@
 
+import argparse
 import os
 import numpy as np
 import gurobipy as gp
 from gurobipy import GRB
 import time
-from branch_and_bound import branch_and_bound
-import pandas as pd
+from concurrent.futures import as_completed
+from result_log import append_row, completed_files, sort_rows
+from worker_pool import run_branch_and_bound, solver_pool, worker_env
 
-# Helper function to extract 100 elements from multiple lines (12 per line)
-def extract_full_row(start_idx, lines_needed, lines):
-    elements = []
-    for i in range(lines_needed):
-        line_elements = list(map(float, lines[start_idx + i].split()))
-        elements.extend(line_elements)
-    return elements
+
+# results_directory
+res_dir = 'results'
+# Create output directory
+output_dir_str = 'lp_files_UFL_Strong'
+output_dir_weak = 'lp_files_UFL_Weak'
 
 
 # Helper function to extract 100 elements from a single line
@@ -22,209 +23,158 @@ def read_ufl_file(filename):
     """
     n - number of clients
     m - number of facilities
-    fixed_cost - fixed cost of opening a facility
-    cost_matrix - cost of connecting a client to a facility
+    fixed_cost - fixed cost of opening a facility (array of length m)
+    cost_matrix - cost of connecting a client to a facility (n x m array)
     """
     with open(filename, 'r') as f:
         lines = f.read().splitlines()
-        # print(lines)
-        fixed_cost = []
-        cost_matrix = []
         m, n = map(int, lines[0].split())
-        # print(n, m)
 
         lines_reqd = m // 7 + 1
-        # print(lines_reqd)
 
         fixed_cost_start_index = 1
         fixed_cost_end_index = m + 1
         init_cost_matrix_start_index = fixed_cost_end_index + 1
 
-        # fixed cost
-        for i in range(fixed_cost_start_index, fixed_cost_end_index):
-            fixed_cost.append(float(lines[i].split()[1]))
-        
-        # cost matrix
+        # fixed cost (second column; capacitated instances have the word "capacity" in the first)
+        fixed_cost = np.array([float(lines[i].split()[1]) for i in range(fixed_cost_start_index, fixed_cost_end_index)])
+
+        # cost matrix: each client's row spans lines_reqd lines after its demand line,
+        # parsed with one numpy call per client
+        cost_matrix = np.empty((n, m))
         for i in range(n):
             cost_matrix_start_index = init_cost_matrix_start_index + i * (lines_reqd + 1)
-            cost_matrix.append(extract_full_row(cost_matrix_start_index, lines_reqd, lines))
-        # print(cost_matrix)
-        
-        return n, m, fixed_cost, cost_matrix    
-
-
-# Helper function to solve the UFL problem
-def solve_ufl_weak(n, m, fixed_cost, cost_matrix, results, file,  output_file):
-    # Create a new model
-    gp.setParam("TimeLimit", 120)
-    model = gp.Model("ufl")
-    model.setParam('OutputFlag', 0)
+            cost_matrix[i] = np.fromstring(' '.join(lines[cost_matrix_start_index:cost_matrix_start_index + lines_reqd]), sep=' ')
 
-    # Create variables
-    y = model.addVars(m, vtype=GRB.BINARY, name="y")
-    x = model.addVars(n, m, vtype=GRB.BINARY, name="x")
+        return n, m, fixed_cost, cost_matrix
 
-    # Set objective
-    model.setObjective(gp.quicksum(fixed_cost[j] * y[j] for j in range(m)) + gp.quicksum(cost_matrix[i][j] * x[i, j] for i in range(n) for j in range(m)), GRB.MINIMIZE)
 
-    # Add constraints
-    model.addConstrs((x.sum(i, '*') == 1 for i in range(n)), name="c1")
-    model.addConstrs((sum(x[i, j] for i in range(n)) <= (n)  * y[j] for j in range(m)), name="c2")
-    model.optimize()
-    total_time = model.Runtime
+def set_concurrent_mip(model):
+    # With at least two threads per solve, run a bound-focused and a feasibility-focused MIP
+    # solve side by side; the instances that hit the time limit usually only struggle with one
+    if model.Params.Threads >= 2:
+        model.setParam('ConcurrentMIP', 2)
+        model.getConcurrentEnv(0).setParam('MIPFocus', 3)
+        model.getConcurrentEnv(1).setParam('MIPFocus', 1)
 
-    best_objective = None
-    best_bound = None
-    gap = None
-    nodes_explored = None
 
-    # if model.status == GRB.OPTIMAL or model.status == GRB.SUBOPTIMAL:
-    best_objective = model.objVal if hasattr(model, 'objVal') else None
-    best_bound = model.ObjBound if hasattr(model, 'ObjBound') else None
-    gap = model.MIPGap * 100 if hasattr(model, 'MIPGap') else None
-    nodes_explored = model.NodeCount if hasattr(model, 'NodeCount') else None
-
-    for var in model.getVars():
-        var.vtype = GRB.CONTINUOUS  # Convert to continuous
-    # Write the modified model with continuous variables to an .lp file
-    model.update()  # Ensure the model reflects changes to the variable types
-
-    results.append({
-        "File": file,
-        "Best Objective": best_objective if best_objective is not None else 'None',
-        "Best Bound": best_bound if best_bound is not None else 'None',
-        "GAP (%)": gap if gap is not None else 'None',
-        "Nodes Explored": nodes_explored if nodes_explored is not None else 'None',
-        "Time Taken (seconds)": total_time
-    })
-    model.write(output_file)
-    # return model
-
-# Helper function to solve the UFL problem
-def solve_ufl_strong(n, m, fixed_cost, cost_matrix, results, file, output_file):
+# Helper function to solve the UFL problem in the weak (mode='weak') or strong (mode='strong')
+# formulation; returns the solved MIP model and its LP relaxation, and writes the relaxation to
+# output_file when one is given
+def solve_ufl(mode, n, m, fixed_cost, cost_matrix, results, file, output_file=None):
     # Create a new model
-    gp.setParam("TimeLimit", 120)
-    model = gp.Model("ufl")
-    model.setParam('OutputFlag', 0)
+    model = gp.Model("ufl", env=worker_env())
+    model.setParam("TimeLimit", 120)
+    set_concurrent_mip(model)
 
-    # Create variables
-    y = model.addVars(m, vtype=GRB.BINARY, name="y")
-    x = model.addVars(n, m, vtype=GRB.BINARY, name="x")
+    # Create variables; matrix variables, so every constraint block below is assembled by Gurobi in one call
+    y = model.addMVar(m, vtype=GRB.BINARY, name="y")
+    x = model.addMVar((n, m), vtype=GRB.BINARY, name="x")
 
     # Set objective
-    model.setObjective(gp.quicksum(fixed_cost[j] * y[j] for j in range(m)) + gp.quicksum(cost_matrix[i][j] * x[i, j] for i in range(n) for j in range(m)), GRB.MINIMIZE)
+    model.setObjective(fixed_cost @ y + (x * cost_matrix).sum(), GRB.MINIMIZE)
 
     # Add constraints
-    model.addConstrs((x.sum(i, '*') == 1 for i in range(n)), name="c1")
-    model.addConstrs((x[i, j] <= y[j] for i in range(n) for j in range(m)), name="c2")
+    model.addConstr(x.sum(axis=1) == 1, name="c1")
+    # The formulations only differ in how a client's assignment is linked to the facility being open
+    if mode == 'weak':
+        model.addConstr(x.sum(axis=0) <= n * y, name="c2")
+    elif mode == 'strong':
+        model.addConstr(x <= y[np.newaxis, :], name="c2")
+    else:
+        raise ValueError(f"unknown UFL formulation {mode!r}")
     model.optimize()
     total_time = model.Runtime
 
-    best_objective = None
-    best_bound = None
-    gap = None
-    nodes_explored = None
-
-    best_objective = model.objVal if hasattr(model, 'objVal') else None
-    best_bound = model.ObjBound if hasattr(model, 'ObjBound') else None
-    gap = model.MIPGap * 100 if hasattr(model, 'MIPGap') else None
-    nodes_explored = model.NodeCount if hasattr(model, 'NodeCount') else None
-    for var in model.getVars():
-        var.vtype = GRB.CONTINUOUS  # Convert to continuous
-    # Write the modified model with continuous variables to an .lp file
-    model.update()  # Ensure the model reflects changes to the variable types
+    # The bound and node count are always set after the solve; the objective and gap only mean
+    # something once a solution was found (without one Gurobi reports an infinite gap)
+    best_objective = model.ObjVal if model.SolCount > 0 else None
+    best_bound = model.ObjBound
+    gap = model.MIPGap * 100 if model.SolCount > 0 else None  # MIPGap is a fraction
+    nodes_explored = model.NodeCount
+
+    # After solving, build the relaxation with every variable continuous
+    relaxed = model.relax()
+
     results.append({
         "File": file,
         "Best Objective": best_objective if best_objective is not None else 'None',
-        "Best Bound": best_bound if best_bound is not None else 'None',
+        "Best Bound": best_bound,
         "GAP (%)": gap if gap is not None else 'None',
-        "Nodes Explored": nodes_explored if nodes_explored is not None else 'None',
+        "Nodes Explored": nodes_explored,
         "Time Taken (seconds)": total_time
     })
-    model.write(output_file)
-    # return model
-
-# results_directory
-res_dir = 'results'
-os.makedirs(res_dir, exist_ok=True)
-
-# Create output directory
-output_dir_str = 'lp_files_UFL_Strong'
-os.makedirs(output_dir_str, exist_ok=True)
-
-output_dir_weak = 'lp_files_UFL_Weak'
-os.makedirs(output_dir_weak, exist_ok=True)
-
-# stronger formulation
-results = []
-for root, dirs, files in os.walk("UFL"):
-        files = sorted(files)
-        for file in files:
-                n, m, f, c = read_ufl_file(os.path.join(root, file))
-                # print("Stronger formulation")
-                solve_ufl_strong(n, m, f, c, results, file, os.path.join(output_dir_str, f"{file}.lp"))
-df = pd.DataFrame(results)
-df.to_csv(os.path.join(res_dir, 'gurobi_ufl_strong.csv'), index=False)
-
-
-# weaker formulation
-results = []
-for root, dirs, files in os.walk("UFL"):
-        files = sorted(files)
-        for file in files:
-            # if file.startswith('capb'):
-                n, m, f, c = read_ufl_file(os.path.join(root, file))
-                # print("Stronger formulation")
-                solve_ufl_weak(n, m, f, c, results, file, os.path.join(output_dir_weak, f"{file}.lp"))
-df = pd.DataFrame(results)
-df.to_csv(os.path.join(res_dir, 'gurobi_ufl_weak.csv'), index=False)
-
-
-# print("Branch and Bound solution")
-
-output_dir_weak = 'lp_files_UFL_Weak'
-os.makedirs(output_dir_weak, exist_ok=True)
-results = []
-# weaker formulation
-for root, dirs, files in os.walk("UFL"):
-    sorted_files = sorted(files)
-    for file in sorted_files:
-            model = gp.read(os.path.join(output_dir_weak, f"{file}.lp"))
-            model.setParam('OutputFlag', 0)
-            best_lp_relaxation, best_objective, time_taken, gap, nodes_explored = branch_and_bound(model)
-            # Append the results to the list
-            results.append({
-                "File": file,
-                "LP Relaxation": best_lp_relaxation if best_lp_relaxation != float('inf') else 'inf',
-                "Best Objective": best_objective if best_objective is not None else 'None',
-                "Nodes Explored": nodes_explored,
-                "Gap (%)": gap if gap != float('inf') else 'inf',
-                "Time Taken (seconds)": time_taken if time_taken is not None else 0
-            })
-# Convert the results list into a pandas DataFrame
-df = pd.DataFrame(results)
-# Save the DataFrame to a CSV file
-df.to_csv(os.path.join(res_dir, 'custom_ufl_weak.csv'), index=False)
-
-
-# # Stronger formulation
-results = []
-for root, dirs, files in os.walk("UFL"):
-    sorted_files = sorted(files)
-    for file in sorted_files:
-        model = gp.read(os.path.join(output_dir_str, f"{file}.lp"))
-        model.setParam('OutputFlag', 0)
-        best_lp_relaxation, best_objective, time_taken, gap, nodes_explored = branch_and_bound(model)
-        results.append({
-            "File": file,
-            "LP Relaxation": best_lp_relaxation if best_lp_relaxation != float('inf') else 'inf',
-            "Best Objective": best_objective if best_objective is not None else 'None',
-            "Nodes Explored": nodes_explored,
-            "Gap (%)": gap if gap != float('inf') else 'inf',
-            "Time Taken (seconds)": time_taken if time_taken is not None else 0
-        })
-
-# Convert the results list into a pandas DataFrame
-df = pd.DataFrame(results)
-# Save the DataFrame to a CSV file
-df.to_csv(os.path.join(res_dir, 'custom_ufl_strong.csv'), index=False)
\ No newline at end of file
+    # Write the relaxation to an .lp file
+    if output_file is not None:
+        relaxed.write(output_file)
+    return model, relaxed
+
+
+# .lp directory of each formulation
+OUTPUT_DIRS = {
+    'strong': output_dir_str,
+    'weak': output_dir_weak,
+}
+
+
+def lp_is_current(lp_file, source):
+    # make-style check: the .lp was written after the instance file last changed
+    return os.path.exists(lp_file) and os.path.getmtime(lp_file) > os.path.getmtime(source)
+
+
+def process_file(file_path, modes=tuple(OUTPUT_DIRS), write_lp=True):
+    # Everything for one instance in a single pass: parse it once, then solve the given
+    # formulations with Gurobi and with the custom branch and bound (a model cannot be passed
+    # between processes). Returns {mode: (gurobi row, custom row)}.
+    file = os.path.basename(file_path)
+    n, m, f, c = read_ufl_file(file_path)
+    rows = {}
+    for mode in modes:
+        lp_file = os.path.join(OUTPUT_DIRS[mode], f"{file}.lp")
+        # An up to date .lp from an earlier run is not written again
+        write = write_lp and not lp_is_current(lp_file, file_path)
+        results = []
+        model, relaxed = solve_ufl(mode, n, m, f, c, results, file, lp_file if write else None)
+        rows[mode] = (results[0], run_branch_and_bound(file, model, relaxed))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--no-lp', action='store_true',
+                        help=f"don't write the LP relaxations to {output_dir_str} and {output_dir_weak}")
+    args = parser.parse_args()
+
+    os.makedirs(res_dir, exist_ok=True)
+    if not args.no_lp:
+        os.makedirs(output_dir_str, exist_ok=True)
+        os.makedirs(output_dir_weak, exist_ok=True)
+
+    # (gurobi csv, custom csv) for each formulation
+    csvs = {
+        'strong': (os.path.join(res_dir, 'gurobi_ufl_strong.csv'), os.path.join(res_dir, 'custom_ufl_strong.csv')),
+        'weak': (os.path.join(res_dir, 'gurobi_ufl_weak.csv'), os.path.join(res_dir, 'custom_ufl_weak.csv')),
+    }
+    done = {mode: (completed_files(gurobi_csv), completed_files(custom_csv)) for mode, (gurobi_csv, custom_csv) in csvs.items()}
+
+    paths = [os.path.join(root, file) for root, dirs, files in os.walk("UFL") for file in sorted(files)]
+
+    with solver_pool() as ex:
+        futures = []
+        for path in paths:
+            file = os.path.basename(path)
+            # Only the formulations still missing a Gurobi or custom row are solved again
+            modes = [mode for mode, (gurobi_done, custom_done) in done.items()
+                     if not (file in gurobi_done and file in custom_done)]
+            if modes:
+                futures.append(ex.submit(process_file, path, modes, not args.no_lp))
+
+        for future in as_completed(futures):
+            for mode, rows in future.result().items():
+                for row, csv_path, completed in zip(rows, csvs[mode], done[mode]):
+                    if row["File"] not in completed:
+                        append_row(csv_path, row)
+
+    for csv_paths in csvs.values():
+        for csv_path in csv_paths:
+            sort_rows(csv_path)
@@ -0,0 +1,59 @@
+import atexit
+import multiprocessing.util
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import gurobipy as gp
+
+from branch_and_bound import branch_and_bound
+
+
+# Instances are independent, so solve several at once and split the cores between them
+THREADS_PER_SOLVE = 2
+WORKERS = max(1, (os.cpu_count() or 1) // THREADS_PER_SOLVE)
+
+# Gurobi environment of the current process: set up by init_worker in a pool worker, or
+# created on first use by worker_env anywhere else
+_env = None
+
+
+def init_worker(threads):
+    # One quiet environment per worker, shared by every model it builds; Threads keeps each
+    # worker's Gurobi from claiming every core
+    global _env
+    _env = gp.Env(params={'OutputFlag': 0, 'Threads': threads})
+    # Release the environment (and its license) when the worker exits; pool workers leave
+    # through os._exit, so atexit handlers would never run there
+    multiprocessing.util.Finalize(None, _env.dispose, exitpriority=10)
+
+
+def worker_env():
+    # Outside a pool worker, models share one quiet environment created the first time it is needed
+    global _env
+    if _env is None:
+        _env = gp.Env(params={'OutputFlag': 0})
+        # Outside a pool worker the process exits normally, so atexit releases it
+        atexit.register(_env.dispose)
+    return _env
+
+
+def solver_pool():
+    # Process pool whose workers each solve with THREADS_PER_SOLVE threads in their own environment
+    return ProcessPoolExecutor(max_workers=WORKERS, initializer=init_worker, initargs=(THREADS_PER_SOLVE,))
+
+
+def run_branch_and_bound(file, model, relaxed, **kwargs):
+    # Hand the in-memory relaxation of the solved MIP model to the custom branch and bound
+    # (kwargs go to branch_and_bound) and return its result row. Only the relaxation is used
+    # from here on, so the MIP is freed before branching and the relaxation right after it
+    model.dispose()
+    best_lp_relaxation, best_objective, time_taken, gap, nodes_explored = branch_and_bound(relaxed, **kwargs)
+    relaxed.dispose()
+    return {
+        "File": file,
+        "LP Relaxation": best_lp_relaxation if best_lp_relaxation != float('inf') else 'inf',
+        "Best Objective": best_objective if best_objective is not None else 'None',
+        "Nodes Explored": nodes_explored,
+        "Gap (%)": gap if gap != float('inf') else 'inf',
+        "Time Taken (seconds)": time_taken if time_taken is not None else 0
+    }